@@ -8,7 +8,7 @@ import pandas as pd
 
 breaks = [0, 1, 5, 10, 15, 30, float("inf")]
 
-csv_files = list(Path("./data/out/").rglob("*.parquet"))
+csv_files = list(Path("./data/out/").glob("*_distances.parquet"))
 
 # Determine the number of rows and columns for subplots
 n_files = len(csv_files)
@@ -0,0 +1,53 @@
+import logging
+
+import polars as pl
+from tqdm import tqdm
+
+from src.common.utils import Config, Paths
+
+FORMAT = "%(message)s"
+logging.basicConfig(level="INFO", format=FORMAT, datefmt="[%X]")
+logger = logging.getLogger(__name__)
+
+
+def _stats(column: str) -> list[pl.Expr]:
+    return [
+        pl.col(column).mean().alias(f"{column}_mean"),
+        pl.col(column).median().alias(f"{column}_median"),
+        *[
+            pl.col(column).quantile(q).alias(f"{column}_p{round(q * 100)}")
+            for q in Config.AGGREGATE_QUANTILES
+        ],
+    ]
+
+
+def aggregate():
+    postcodes = pl.read_parquet(
+        Paths.PROCESSED / "onspd" / "postcodes.parquet",
+        columns=["postcode", *Config.GEOGRAPHIES],
+    )
+    for file in tqdm(sorted(Paths.OUT.glob("*_distances.parquet"))):
+        layer = file.stem.removesuffix("_distances")
+        logger.info(f"Aggregating {layer}...")
+        distances = pl.read_parquet(file)
+        columns = [col for col in distances.columns if col.startswith("distance")]
+        distances = distances.select(["postcode", *columns]).join(
+            postcodes, on="postcode", how="left"
+        )
+        for level in Config.GEOGRAPHIES:
+            outfile = Paths.AGGREGATES / level / f"{layer}.parquet"
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            (
+                distances.drop_nulls(level)
+                .group_by(level)
+                .agg(
+                    pl.len().alias("postcodes"),
+                    *[expr for col in columns for expr in _stats(col)],
+                )
+                .sort(pl.col(level).cast(pl.String))
+                .write_parquet(outfile)
+            )
+
+
+if __name__ == "__main__":
+    aggregate()
@@ -0,0 +1,121 @@
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+STAGES = ["load", "snap", "search", "write"]
+
+
+def current_rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 1024**2
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    # ru_maxrss is reported in bytes on macOS and KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class LayerMetrics:
+    layer: str
+    tile: str = ""
+    sources: int = 0
+    targets: int = 0
+    nodes_settled: int = 0
+    edges_relaxed: int = 0
+    # scipy does not expose its heap counters, so this is an upper bound of one
+    # insert and one pop per settled node plus a decrease-key per relaxed edge
+    heap_ops: int = 0
+    # rss_delta_mb is the change in resident memory over this layer, while
+    # process_peak_rss_mb is the high-water mark of the whole process so far
+    rss_mb: float = 0.0
+    rss_delta_mb: float = 0.0
+    process_peak_rss_mb: float = 0.0
+    seconds: dict[str, float] = field(
+        default_factory=lambda: dict.fromkeys(STAGES, 0.0)
+    )
+
+    def __post_init__(self):
+        self._rss_start = current_rss_mb()
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+
+    def record_search(self, settled: int, relaxed: int):
+        self.nodes_settled += settled
+        self.edges_relaxed += relaxed
+        self.heap_ops += 2 * settled + relaxed
+
+    def record_rss(self):
+        self.rss_mb = current_rss_mb()
+        self.rss_delta_mb = self.rss_mb - self._rss_start
+        self.process_peak_rss_mb = peak_rss_mb()
+
+    def row(self) -> dict:
+        row = asdict(self)
+        seconds = row.pop("seconds")
+        return {**row, **{f"{stage}_seconds": secs for stage, secs in seconds.items()}}
+
+
+def write_report(metrics: list[LayerMetrics], outfile: Path, prometheus: Path | None):
+    rows = [m.row() for m in metrics]
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    outfile.with_suffix(".json").write_text(json.dumps(rows, indent=2))
+    with open(outfile.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    if prometheus is not None:
+        _write_prometheus(metrics, prometheus)
+
+
+def _write_prometheus(metrics: list[LayerMetrics], outfile: Path):
+    gauges = {
+        "sources": "Number of POIs routed from.",
+        "targets": "Number of postcodes routed to.",
+        "nodes_settled": "Nodes settled by the shortest path searches.",
+        "edges_relaxed": "Edges relaxed by the shortest path searches.",
+        "heap_ops": "Upper bound on heap operations in the shortest path searches.",
+        "rss_mb": "Resident set size in MB after routing the layer.",
+        "rss_delta_mb": "Change in resident set size in MB over the layer.",
+        "process_peak_rss_mb": "Peak resident set size of the process so far in MB.",
+    }
+    lines = [
+        "# HELP access_routing_stage_seconds Time spent in each routing stage.",
+        "# TYPE access_routing_stage_seconds gauge",
+    ]
+    for m in metrics:
+        for stage, secs in m.seconds.items():
+            labels = f'layer="{m.layer}",tile="{m.tile}",stage="{stage}"'
+            lines.append(f"access_routing_stage_seconds{{{labels}}} {secs:.6f}")
+    for gauge, description in gauges.items():
+        lines.append(f"# HELP access_routing_{gauge} {description}")
+        lines.append(f"# TYPE access_routing_{gauge} gauge")
+        for m in metrics:
+            labels = f'layer="{m.layer}",tile="{m.tile}"'
+            lines.append(f"access_routing_{gauge}{{{labels}}} {getattr(m, gauge)}")
+
+    # node_exporter may read the textfile at any time, so swap it in atomically
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    partial = outfile.with_suffix(".prom.tmp")
+    partial.write_text("\n".join(lines) + "\n")
+    partial.replace(outfile)
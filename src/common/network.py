@@ -0,0 +1,138 @@
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from src.common.metrics import LayerMetrics
+from src.common.utils import Config
+
+
+def distance_column(profile: str) -> str:
+    return "distance" if profile == "drive" else f"distance_{profile}"
+
+
+def facility_column(profile: str) -> str:
+    return "facility" if profile == "drive" else f"facility_{profile}"
+
+
+# the road network is held once as a CSR adjacency with one weight array per
+# profile; profiles that can use the same edges share `indptr` and `indices`, so
+# routing an extra profile usually only costs one float array per edge
+class Network:
+    def __init__(
+        self,
+        nodes: pd.DataFrame,
+        edges: pd.DataFrame,
+        profiles: list[str] | None = None,
+    ):
+        self.profiles = profiles or list(Config.PROFILES)
+        self.size = len(nodes)
+        self.tree = cKDTree(nodes[["easting", "northing"]].to_numpy())
+        # connected component labels from the full network, added in preprocessing
+        self.components = {
+            profile: nodes[f"component_{profile}"].to_numpy()
+            for profile in self.profiles
+            if f"component_{profile}" in nodes.columns
+        }
+
+        node_index = pd.Index(nodes["node_id"])
+        start = node_index.get_indexer(edges["start_node"])
+        end = node_index.get_indexer(edges["end_node"])
+        valid = (start >= 0) & (end >= 0)
+        start, end = start[valid], end[valid]
+
+        # roads are traversable both ways, so each edge is stored in both
+        # directions and searched as a directed graph to avoid scipy symmetrising
+        rows = np.concatenate([start, end])
+        order = np.argsort(rows, kind="stable")
+        rows = rows[order]
+        cols = np.concatenate([end, start])[order].astype(np.int32)
+
+        # edges a profile cannot use (motorways on foot) have infinite weights and
+        # are dropped from its adjacency, scipy would still search across them
+        self.topology, self.weights = {}, {}
+        shared = []
+        for profile in self.profiles:
+            weight = edges[Config.PROFILES[profile]].to_numpy(np.float64)[valid]
+            weight = np.concatenate([weight, weight])[order]
+            usable = np.isfinite(weight)
+            for mask, topology in shared:
+                if np.array_equal(mask, usable):
+                    break
+            else:
+                topology = self._topology(rows[usable], cols[usable])
+                shared.append((usable, topology))
+            self.topology[profile] = topology
+            self.weights[profile] = weight if usable.all() else weight[usable]
+
+    def _topology(self, rows: np.ndarray, cols: np.ndarray):
+        indptr = np.zeros(self.size + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=self.size), out=indptr[1:])
+        return indptr, cols
+
+    def graph(self, profile: str) -> csr_matrix:
+        indptr, indices = self.topology[profile]
+        return csr_matrix(
+            (self.weights[profile], indices, indptr),
+            shape=(self.size, self.size),
+            copy=False,
+        )
+
+    def snap(self, points: pd.DataFrame) -> np.ndarray:
+        _, nearest = self.tree.query(points[["easting", "northing"]].to_numpy())
+        return nearest
+
+    def route(
+        self,
+        source: pd.DataFrame,
+        target: pd.DataFrame,
+        profiles: list[str] | None = None,
+        facilities: pd.Series | None = None,
+        metrics: LayerMetrics | None = None,
+    ) -> pd.DataFrame:
+        distances = target.reset_index(drop=True)
+        profiles = profiles or self.profiles
+        if metrics is not None:
+            metrics.sources, metrics.targets = len(source), len(target)
+        if source.empty:
+            for profile in profiles:
+                distances[distance_column(profile)] = np.nan
+                distances[facility_column(profile)] = None
+            return distances
+
+        with metrics.time("snap") if metrics is not None else nullcontext():
+            source_nodes = self.snap(source)
+            target_nodes = self.snap(target)
+        # POIs snapped to the same node are tied, the first one claims the node
+        facility_by_node = pd.Series(
+            source.index if facilities is None else facilities.to_numpy(),
+            index=source_nodes,
+        )
+        facility_by_node = facility_by_node[~facility_by_node.index.duplicated()]
+
+        for profile in profiles:
+            # the multi-source search already tracks which origin settled each
+            # node, so the nearest facility comes for free with the distance
+            with metrics.time("search") if metrics is not None else nullcontext():
+                dist, _, origin = dijkstra(
+                    self.graph(profile),
+                    indices=facility_by_node.index.to_numpy(),
+                    min_only=True,
+                    return_predecessors=True,
+                )
+            if metrics is not None:
+                settled = np.isfinite(dist)
+                degree = np.diff(self.topology[profile][0])
+                metrics.record_search(int(settled.sum()), int(degree[settled].sum()))
+
+            dist = dist[target_nodes]
+            reached = np.isfinite(dist)
+            dist[~reached] = np.nan
+            facility = facility_by_node.reindex(origin[target_nodes]).to_numpy(object)
+            facility[~reached] = None
+            distances[distance_column(profile)] = dist
+            distances[facility_column(profile)] = facility
+        return distances
@@ -0,0 +1,90 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.common.utils import Config, Paths
+
+MINUTE_METRES = Config.MAX_SPEED_MPH * 1609.344 / 60
+
+
+def _grid_square(e100: int, n100: int) -> str:
+    # two letter OS national grid reference for a 100km square, skipping "I"
+    l1 = (19 - n100) - (19 - n100) % 5 + (e100 + 10) // 5
+    l2 = (19 - n100) * 5 % 25 + e100 % 5
+    if l1 > 7:
+        l1 += 1
+    if l2 > 7:
+        l2 += 1
+    return chr(l1 + 65) + chr(l2 + 65)
+
+
+def assign_tiles(postcodes: pd.DataFrame, scheme: str = "grid") -> pd.Series:
+    if scheme == "nation":
+        return postcodes["ctry"].map(Config.NATIONS)
+    if scheme != "grid":
+        raise ValueError(f"Unknown tiling scheme: {scheme}")
+    squares = pd.DataFrame(
+        {
+            "e100": (postcodes["easting"] // 100_000).astype(int),
+            "n100": (postcodes["northing"] // 100_000).astype(int),
+        },
+        index=postcodes.index,
+    )
+    names = {
+        (e, n): _grid_square(e, n)
+        for e, n in squares.drop_duplicates().itertuples(index=False)
+    }
+    return pd.Series(
+        [names[key] for key in squares.itertuples(index=False, name=None)],
+        index=postcodes.index,
+    )
+
+
+def tile_bounds(
+    target: pd.DataFrame, buffer_minutes: float = Config.TILE_BUFFER_MINUTES
+) -> tuple[float, float, float, float]:
+    buffer = buffer_minutes * MINUTE_METRES
+    return (
+        target["easting"].min() - buffer,
+        target["northing"].min() - buffer,
+        target["easting"].max() + buffer,
+        target["northing"].max() + buffer,
+    )
+
+
+def within(df: pd.DataFrame, bounds: tuple[float, float, float, float]) -> pd.Series:
+    xmin, ymin, xmax, ymax = bounds
+    return df["easting"].between(xmin, xmax) & df["northing"].between(ymin, ymax)
+
+
+def exact_minutes(profile: str, buffer_minutes: float) -> float:
+    # clips are sized for driving at MAX_SPEED_MPH, so slower profiles stay
+    # inside them for proportionally longer
+    if profile not in Config.PROFILE_SPEEDS_KMH:
+        return buffer_minutes
+    profile_metres = Config.PROFILE_SPEEDS_KMH[profile] * 1000 / 60
+    return buffer_minutes * MINUTE_METRES / profile_metres
+
+
+def read_clip(
+    bounds: tuple[float, float, float, float],
+) -> tuple[pd.DataFrame, pd.DataFrame, bool]:
+    # only the nodes inside the clip and the edges between them are read, so a
+    # tile never holds the national network unless its clip covers all of it
+    xmin, ymin, xmax, ymax = bounds
+    nodes_path = Paths.PROCESSED / "oproad" / "nodes.parquet"
+    nodes = pd.read_parquet(
+        nodes_path,
+        filters=[
+            ("easting", ">=", xmin),
+            ("easting", "<=", xmax),
+            ("northing", ">=", ymin),
+            ("northing", "<=", ymax),
+        ],
+    )
+    node_ids = nodes["node_id"].tolist()
+    edges = pd.read_parquet(
+        Paths.PROCESSED / "oproad" / "edges.parquet",
+        filters=[("start_node", "in", node_ids), ("end_node", "in", node_ids)],
+    )
+    complete = len(nodes) == pq.read_metadata(nodes_path).num_rows
+    return nodes, edges, complete
@@ -6,6 +6,11 @@ class Paths:
     RAW = DATA / "raw"
     PROCESSED = DATA / "processed"
     OUT = DATA / "out"
+    TILES = OUT / "tiles"
+    CATCHMENTS = OUT / "catchments"
+    LOOKUP = OUT / "lookup"
+    AGGREGATES = OUT / "aggregates"
+    METRICS = OUT / "metrics"
 
 
 class Config:
@@ -22,6 +27,59 @@ class Config:
         "trainstations",
     ]
 
+    # edge weight column holding the travel time in minutes for each profile, the
+    # drive times come from ukroutes while walk and cycle are derived from length
+    PROFILES = {"drive": "time_weighted", "walk": "time_walk", "cycle": "time_cycle"}
+    PROFILE_SPEEDS_KMH = {"walk": 4.8, "cycle": 16}
+    NON_MOTORISED_EXCLUDED = ["Motorway"]
+
+    # column identifying each POI in the facility outputs, bluespace points have
+    # no identifier so are numbered by row instead
+    POI_IDS = {
+        "bluespace": None,
+        "busstops": "code",
+        "dentists": "code",
+        "evpoints": "chargeDeviceID",
+        "gppracs": "code",
+        "greenspace": "id",
+        "hospitals": "code",
+        "pharmacies": "code",
+        "primary_schools": "code",
+        "secondary_schools": "code",
+        "trainstations": "code",
+        "pubs": "id",
+        "restaurants": "id",
+        "post_offices": "id",
+        "cafes": "id",
+        "convenience_stores": "id",
+    }
+
+    # SPEC.md domains covered by the routed layers, used for the composite index
+    DOMAINS = {
+        "green_space": ["greenspace", "bluespace"],
+        "health": ["gppracs", "dentists", "pharmacies", "hospitals"],
+        "education": ["primary_schools", "secondary_schools"],
+        "sustenance": ["convenience_stores"],
+        "transport": ["busstops", "trainstations", "evpoints"],
+        "services": ["post_offices"],
+        "food_and_drink": ["restaurants", "cafes", "pubs"],
+    }
+    INDEX_BATCH_SIZE = 100_000
+
+    # ONSPD geography levels kept with each postcode for area level aggregates
+    GEOGRAPHIES = ["lsoa21", "lad", "ctry"]
+    AGGREGATE_QUANTILES = [0.1, 0.25, 0.75, 0.9]
+
+    # routing tiles are clipped to the target extent plus the distance a vehicle
+    # can cover in the buffer time, so any route shorter than the buffer is exact
+    TILE_BUFFER_MINUTES = 60
+    MAX_SPEED_MPH = 70
+    NATIONS = {
+        "E92000001": "england",
+        "S92000003": "scotland",
+        "W92000004": "wales",
+    }
+
     NHS_ENG_URL = "https://files.digital.nhs.uk/assets/ods/current/"
     NHS_ENG_FILES = {
         "gppracs": "epraccur.zip",
@@ -0,0 +1,150 @@
+import argparse
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.common.network import distance_column
+from src.common.utils import Config, Paths
+
+FORMAT = "%(message)s"
+logging.basicConfig(level="INFO", format=FORMAT, datefmt="[%X]")
+logger = logging.getLogger(__name__)
+
+
+# scores are log1p(minutes) capped at a day, which is also the score given to a
+# postcode that cannot reach any POI in a layer
+UPPER = np.log1p(24 * 60)
+
+
+class QuantileSketch:
+    # fixed width histogram over log1p(minutes), anything past a day is clipped
+    # into the last bin; with 20,000 bins each one spans under 0.04% in minutes
+    def __init__(self, upper: float = UPPER, bins: int = 20_000):
+        self.width = upper / bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def _bins(self, values: np.ndarray) -> np.ndarray:
+        return np.clip(values / self.width, 0, len(self.counts) - 1).astype(np.int64)
+
+    def update(self, values: np.ndarray):
+        values = values[np.isfinite(values)]
+        self.counts += np.bincount(self._bins(values), minlength=len(self.counts))
+
+    def below(self, values: np.ndarray) -> np.ndarray:
+        # number of sketched values in bins strictly below each value
+        below = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        bins = self._bins(np.nan_to_num(values))
+        return np.where(np.isfinite(values), below[bins], np.nan)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+
+def _mean(arrays: list[np.ndarray]) -> np.ndarray:
+    stacked = np.vstack(arrays)
+    count = np.isfinite(stacked).sum(axis=0)
+    total = np.nansum(stacked, axis=0)
+    return np.divide(total, count, out=np.full(len(total), np.nan), where=count > 0)
+
+
+def _aligned_batches(profile: str):
+    column = distance_column(profile)
+    layers = [
+        layer
+        for layers in Config.DOMAINS.values()
+        for layer in layers
+        if (Paths.OUT / f"{layer}_distances.parquet").exists()
+    ]
+    readers = [
+        pq.ParquetFile(Paths.OUT / f"{layer}_distances.parquet").iter_batches(
+            batch_size=Config.INDEX_BATCH_SIZE, columns=["postcode", column]
+        )
+        for layer in layers
+    ]
+    for batches in zip(*readers, strict=True):
+        postcodes = batches[0].column("postcode")
+        for layer, batch in zip(layers, batches):
+            if not batch.column("postcode").equals(postcodes):
+                raise ValueError(
+                    f"{layer}_distances.parquet is not in the same postcode order "
+                    "as the other layers, rerun routing to rewrite it."
+                )
+        yield postcodes, {
+            layer: batch.column(column).to_numpy(zero_copy_only=False)
+            for layer, batch in zip(layers, batches)
+        }
+
+
+def build_index(profile: str = "drive"):
+    logger.info(f"Building {profile} access index...")
+    outfile = Paths.OUT / f"index_{profile}.parquet"
+    partial = outfile.with_suffix(".partial.parquet")
+    sketches = {score: QuantileSketch() for score in [*Config.DOMAINS, "overall"]}
+
+    # the only pass over the distance tables: log1p puts every layer on a
+    # comparable scale, domains average their layers and overall averages domains;
+    # unreachable layers score the upper bound so they count against a postcode
+    writer = None
+    for postcodes, distances in _aligned_batches(profile):
+        logged = {
+            layer: np.minimum(np.log1p(np.nan_to_num(values, nan=np.inf)), UPPER)
+            for layer, values in distances.items()
+        }
+        batch = {
+            domain: _mean([logged[layer] for layer in layers if layer in logged])
+            for domain, layers in Config.DOMAINS.items()
+            if any(layer in logged for layer in layers)
+        }
+        batch["overall"] = _mean(list(batch.values()))
+        for score, values in batch.items():
+            sketches[score].update(values)
+
+        table = pa.table({"postcode": postcodes, **batch})
+        if writer is None:
+            writer = pq.ParquetWriter(partial, table.schema)
+        writer.write_table(table)
+    if writer is None:
+        logger.warning("No distance tables found, nothing to index.")
+        return
+    writer.close()
+
+    # ranks and deciles come from the finished sketches, so the much smaller
+    # score table is streamed once more to add them
+    writer = None
+    for batch in pq.ParquetFile(partial).iter_batches(
+        batch_size=Config.INDEX_BATCH_SIZE
+    ):
+        columns = {"postcode": batch.column("postcode")}
+        for score in batch.schema.names[1:]:
+            values = batch.column(score).to_numpy(zero_copy_only=False)
+            sketch = sketches[score]
+            below = sketch.below(values)
+            columns[score] = values
+            columns[f"{score}_norm"] = 1 - below / sketch.total
+            columns[f"{score}_rank"] = pa.array(below + 1, from_pandas=True).cast(
+                pa.int64()
+            )
+            columns[f"{score}_decile"] = pa.array(
+                np.floor(below / sketch.total * 10) + 1, from_pandas=True
+            ).cast(pa.int8())
+        table = pa.table(columns)
+        if writer is None:
+            writer = pq.ParquetWriter(outfile, table.schema)
+        writer.write_table(table)
+    writer.close()
+    partial.unlink()
+    logger.info(f"Written {outfile}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Composite access index.")
+    parser.add_argument("--profile", choices=list(Config.PROFILES), default="drive")
+    args = parser.parse_args()
+    build_index(args.profile)
+
+
+if __name__ == "__main__":
+    main()
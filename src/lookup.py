@@ -0,0 +1,155 @@
+import argparse
+import json
+import logging
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import polars as pl
+
+from src.common.utils import Paths
+
+FORMAT = "%(message)s"
+logging.basicConfig(level="INFO", format=FORMAT, datefmt="[%X]")
+logger = logging.getLogger(__name__)
+
+
+def normalise(postcode: str) -> str:
+    return "".join(postcode.split()).upper()
+
+
+def build():
+    logger.info("Building postcode lookup...")
+    table = None
+    for file in sorted(Paths.OUT.glob("*_distances.parquet")):
+        layer = file.stem.removesuffix("_distances")
+        distances = pl.scan_parquet(file).drop(["easting", "northing"])
+        distances = distances.rename(
+            {
+                col: f"{layer}_{col}"
+                for col in distances.collect_schema().names()
+                if col != "postcode"
+            }
+        )
+        table = (
+            distances
+            if table is None
+            else table.join(distances, on="postcode", how="left")
+        )
+    if table is None:
+        logger.warning("No distance tables found, nothing to build.")
+        return
+
+    # sorting by district keeps every district contiguous, so one can be pulled
+    # out of the memory mapped table as a single slice
+    table = (
+        table.with_columns(pl.col("postcode").str.head(-3).alias("district"))
+        .sort(["district", "postcode"])
+        .collect()
+    )
+    Paths.LOOKUP.mkdir(parents=True, exist_ok=True)
+    table.drop("district").write_ipc(
+        Paths.LOOKUP / "postcodes.arrow", compression="uncompressed"
+    )
+    (
+        table.select("district")
+        .with_row_index("start")
+        .group_by("district", maintain_order=True)
+        .agg(pl.col("start").first(), pl.len().alias("length"))
+        .write_parquet(Paths.LOOKUP / "districts.parquet")
+    )
+
+
+class PostcodeLookup:
+    def __init__(self, cache_size: int = 4096):
+        self.table = pl.read_ipc(Paths.LOOKUP / "postcodes.arrow", memory_map=True)
+        districts = pl.read_parquet(Paths.LOOKUP / "districts.parquet")
+        self.districts = {
+            district: (start, length)
+            for district, start, length in districts.iter_rows()
+        }
+        self._district = lru_cache(maxsize=cache_size)(self._read_district)
+
+    def _read_district(self, district: str) -> dict[str, dict]:
+        if district not in self.districts:
+            return {}
+        rows = self.table.slice(*self.districts[district]).to_dicts()
+        return {row["postcode"]: row for row in rows}
+
+    def get(self, postcode: str) -> dict | None:
+        postcode = normalise(postcode)
+        return self._district(postcode[:-3]).get(postcode)
+
+    def get_many(self, postcodes: list[str]) -> dict[str, dict | None]:
+        return {postcode: self.get(postcode) for postcode in postcodes}
+
+
+def _handler(lookup: PostcodeLookup):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        # GET /postcodes/<postcode>
+        def do_GET(self):
+            prefix = "/postcodes/"
+            path = urlsplit(self.path).path
+            if not path.startswith(prefix):
+                return self._send(404, {"error": "not found"})
+            row = lookup.get(unquote(path.removeprefix(prefix)))
+            if row is None:
+                return self._send(404, {"error": "unknown postcode"})
+            self._send(200, row)
+
+        # POST /postcodes with a JSON list of postcodes
+        def do_POST(self):
+            if urlsplit(self.path).path.rstrip("/") != "/postcodes":
+                return self._send(404, {"error": "not found"})
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                postcodes = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError:
+                return self._send(400, {"error": "expected a JSON list of postcodes"})
+            if not isinstance(postcodes, list):
+                return self._send(400, {"error": "expected a JSON list of postcodes"})
+            self._send(200, lookup.get_many([str(pc) for pc in postcodes]))
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, cache_size: int = 4096):
+    lookup = PostcodeLookup(cache_size)
+    server = ThreadingHTTPServer((host, port), _handler(lookup))
+    logger.info(f"Serving {len(lookup.table)} postcodes on http://{host}:{port}...")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Postcode accessibility lookups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="combine *_distances.parquet into one table")
+    query = commands.add_parser("query", help="print the rows for some postcodes")
+    query.add_argument("postcodes", nargs="+")
+    server = commands.add_parser("serve", help="serve lookups over HTTP")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8000)
+    server.add_argument("--cache-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build()
+    elif args.command == "query":
+        print(json.dumps(PostcodeLookup().get_many(args.postcodes), indent=2))
+    else:
+        serve(args.host, args.port, args.cache_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,11 @@ import geopandas as gpd
 import pandas as pd
 import polars as pl
 from pyproj import Transformer
+from scipy.sparse.csgraph import connected_components
 from shapely import MultiPolygon, Polygon
 from ukroutes.oproad.utils import process_oproad
 
+from src.common.network import Network
 from src.common.utils import Config, Paths
 
 FORMAT = "%(message)s"
@@ -47,19 +49,53 @@ def _fetch_scot_records(resource_id: str, limit: int = 100) -> pl.DataFrame:
 
 def process_postcodes():
     logger.info("Processing postcodes...")
+    # ONSPD has no population counts, these are the 2011 census postcode
+    # estimates, which are optional as only the catchments use them
+    population_file = Paths.RAW / "onspd" / "Postcode_Estimates_Table_1.csv"
+    if population_file.exists():
+        population = (
+            pl.read_csv(population_file, columns=["Postcode", "Total"])
+            .rename({"Postcode": "postcode", "Total": "population"})
+            .with_columns(pl.col("postcode").str.replace_all(" ", ""))
+        )
+    else:
+        logger.warning(f"{population_file} not found, populations will be null.")
+        population = pl.DataFrame(
+            schema={"postcode": pl.String, "population": pl.Int64}
+        )
     (
         pl.read_csv(
             Paths.RAW / "onspd" / "ONSPD_FEB_2024.csv",
-            columns=["PCD", "OSEAST1M", "OSNRTH1M", "DOTERM", "CTRY"],
+            columns=[
+                "PCD",
+                "OSEAST1M",
+                "OSNRTH1M",
+                "DOTERM",
+                "CTRY",
+                "OSLAUA",
+                "LSOA21",
+            ],
         )
-        .rename({"PCD": "postcode", "OSEAST1M": "easting", "OSNRTH1M": "northing"})
-        .with_columns(pl.col("postcode").str.replace(" ", ""))
+        .rename(
+            {
+                "PCD": "postcode",
+                "OSEAST1M": "easting",
+                "OSNRTH1M": "northing",
+                "CTRY": "ctry",
+                "OSLAUA": "lad",
+                "LSOA21": "lsoa21",
+            }
+        )
+        .with_columns(pl.col("postcode").str.replace_all(" ", ""))
         .filter(
             (pl.col("DOTERM").is_null())
-            & (pl.col("CTRY").is_in(["N92000002", "L93000001", "M83000003"]).not_())
+            & (pl.col("ctry").is_in(["N92000002", "L93000001", "M83000003"]).not_())
         )
-        .drop(["DOTERM", "CTRY"])
-        .drop_nulls()
+        .drop("DOTERM")
+        .drop_nulls(["postcode", "easting", "northing"])
+        # geography codes repeat across many postcodes, so are stored as categoricals
+        .with_columns(pl.col(Config.GEOGRAPHIES).cast(pl.Categorical))
+        .join(population, on="postcode", how="left")
         .write_parquet(Paths.PROCESSED / "onspd" / "postcodes.parquet")
     )
 
@@ -406,8 +442,9 @@ def process_trainstations():
     (
         pl.read_csv(
             Paths.RAW / "transport" / "stations.csv",
-            columns=["stationName", "lat", "long"],
+            columns=["crsCode", "lat", "long"],
         )
+        .rename({"crsCode": "code"})
         .with_columns(
             pl.struct(pl.col("lat"), pl.col("long"))
             .map_elements(
@@ -420,7 +457,7 @@ def process_trainstations():
             pl.col("coords").list[0].alias("easting"),
             pl.col("coords").list[1].alias("northing"),
         )
-        .select(["stationName", "easting", "northing"])
+        .select(["code", "easting", "northing"])
         .write_parquet(Paths.PROCESSED / "trainstations.parquet")
     )
 
@@ -476,6 +513,62 @@ def process_overture():
     convenience_stores.write_parquet(Paths.PROCESSED / "convenience_stores.parquet")
 
 
+def process_profiles():
+    logger.info("Processing walk and cycle edge weights...")
+    edges_path = Paths.PROCESSED / "oproad" / "edges.parquet"
+    edges = pl.read_parquet(edges_path)
+    edges.with_columns(
+        [
+            pl.when(pl.col("road_classification").is_in(Config.NON_MOTORISED_EXCLUDED))
+            .then(float("inf"))
+            .otherwise(pl.col("length") / 1000 / speed * 60)
+            .alias(Config.PROFILES[profile])
+            for profile, speed in Config.PROFILE_SPEEDS_KMH.items()
+        ]
+    ).write_parquet(edges_path)
+
+
+def process_components():
+    # tiles use these to tell a postcode that cannot reach any POI from one whose
+    # nearest POI was just left out of the clip
+    logger.info("Processing road network components...")
+    nodes_path = Paths.PROCESSED / "oproad" / "nodes.parquet"
+    nodes = pd.read_parquet(nodes_path)
+    edges = pd.read_parquet(Paths.PROCESSED / "oproad" / "edges.parquet")
+    network = Network(nodes, edges)
+
+    extents, poi_components = [], []
+    for profile in network.profiles:
+        _, labels = connected_components(network.graph(profile), directed=False)
+        nodes[f"component_{profile}"] = labels
+        extents.append(
+            nodes.groupby(f"component_{profile}")
+            .agg(
+                xmin=("easting", "min"),
+                ymin=("northing", "min"),
+                xmax=("easting", "max"),
+                ymax=("northing", "max"),
+            )
+            .rename_axis("component")
+            .reset_index()
+            .assign(profile=profile)
+        )
+        for file in sorted(Paths.PROCESSED.glob("*.parquet")):
+            pois = pd.read_parquet(file, columns=["easting", "northing"]).dropna()
+            poi_components.append(
+                pd.DataFrame(
+                    {"component": pd.unique(labels[network.snap(pois)])}
+                ).assign(layer=file.stem, profile=profile)
+            )
+    nodes.to_parquet(nodes_path)
+    pd.concat(extents, ignore_index=True).to_parquet(
+        Paths.PROCESSED / "oproad" / "components.parquet"
+    )
+    pd.concat(poi_components, ignore_index=True).to_parquet(
+        Paths.PROCESSED / "oproad" / "poi_components.parquet"
+    )
+
+
 def main():
     process_postcodes()
     postcodes = pl.read_parquet(Paths.PROCESSED / "onspd" / "postcodes.parquet")
@@ -494,6 +587,8 @@ def main():
     process_overture()
 
     _ = process_oproad(save=True)
+    process_profiles()
+    process_components()
 
 
 if __name__ == "__main__":
@@ -1,28 +1,329 @@
+import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from ukroutes.routing import Route
 
-from src.common.utils import Paths
+from src.common.metrics import LayerMetrics, write_report
+from src.common.network import Network, distance_column, facility_column
+from src.common.tiles import (
+    assign_tiles,
+    exact_minutes,
+    read_clip,
+    tile_bounds,
+    within,
+)
+from src.common.utils import Config, Paths
 
 FORMAT = "%(message)s"
 logging.basicConfig(level="INFO", format=FORMAT, datefmt="[%X]")
 logger = logging.getLogger(__name__)
 
-postcodes = pd.read_parquet(Paths.PROCESSED / "onspd" / "postcodes.parquet")
-nodes = pd.read_parquet(Paths.PROCESSED / "oproad" / "nodes.parquet")
-edges = pd.read_parquet(Paths.PROCESSED / "oproad" / "edges.parquet")
-
-pq_files = list(Paths.PROCESSED.glob("*.parquet"))
-for file in tqdm(pq_files):
-    outfile = Paths.OUT / f"{file.stem}_distances.parquet"
-    if outfile.exists():
-        logger.info(f"Skipping {file} as {outfile} already exists.")
-        continue
-    logger.info(f"Processing {file}...")
-    source = pd.read_parquet(file).dropna(subset=["easting", "northing"])
-    route = Route(source=source, target=postcodes, nodes=nodes, edges=edges)
-    distances = route.route()
-    distances.to_parquet(outfile)
-    logger.info(f"Done processing {file}...")
+TARGET_COLUMNS = ["postcode", "easting", "northing"]
+
+
+@cache
+def _load_postcodes() -> pd.DataFrame:
+    return pd.read_parquet(Paths.PROCESSED / "onspd" / "postcodes.parquet")
+
+
+def _load_network() -> tuple[pd.DataFrame, pd.DataFrame]:
+    nodes = pd.read_parquet(Paths.PROCESSED / "oproad" / "nodes.parquet")
+    edges = pd.read_parquet(Paths.PROCESSED / "oproad" / "edges.parquet")
+    return nodes, edges
+
+
+@cache
+def _load_components() -> tuple[pd.DataFrame, dict[tuple[str, str], np.ndarray]]:
+    extents = pd.read_parquet(Paths.PROCESSED / "oproad" / "components.parquet")
+    pois = pd.read_parquet(Paths.PROCESSED / "oproad" / "poi_components.parquet")
+    return extents.set_index(["profile", "component"]), {
+        key: group["component"].to_numpy()
+        for key, group in pois.groupby(["layer", "profile"])
+    }
+
+
+def _layers():
+    return sorted(Paths.PROCESSED.glob("*.parquet"))
+
+
+def _facilities(source: pd.DataFrame, layer: str) -> pd.Series:
+    column = Config.POI_IDS[layer]
+    if column is None:
+        return pd.Series(source.index, index=source.index)
+    return source[column]
+
+
+def write_catchments(distances: pd.DataFrame, layer: str):
+    postcodes = _load_postcodes()
+    distances = distances.merge(
+        postcodes[["postcode", "population"]], on="postcode", how="left"
+    )
+    catchments = [
+        distances.groupby(facility_column(profile))
+        .agg(
+            postcodes=("postcode", "size"),
+            # facilities serving only postcodes without estimates stay null
+            population=("population", lambda pop: pop.sum(min_count=1)),
+        )
+        .rename_axis("facility")
+        .reset_index()
+        .assign(profile=profile)
+        for profile in Config.PROFILES
+        if facility_column(profile) in distances.columns
+    ]
+    outfile = Paths.CATCHMENTS / f"{layer}_catchments.parquet"
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    pd.concat(catchments, ignore_index=True).to_parquet(outfile)
+
+
+def write_distances(distances: pd.DataFrame, layer: str):
+    # every layer is written in postcode order so downstream stages can stream
+    # several layers side by side in aligned batches
+    distances = distances.sort_values("postcode", ignore_index=True)
+    distances.to_parquet(Paths.OUT / f"{layer}_distances.parquet")
+    write_catchments(distances, layer)
+
+
+def route_all(profiles: list[str] | None = None, prometheus: Path | None = None):
+    report = [LayerMetrics("network")]
+    with report[0].time("load"):
+        postcodes = _load_postcodes()
+        network = Network(*_load_network(), profiles)
+    report[0].record_rss()
+
+    for file in tqdm(_layers()):
+        outfile = Paths.OUT / f"{file.stem}_distances.parquet"
+        if outfile.exists():
+            logger.info(f"Skipping {file} as {outfile} already exists.")
+            continue
+        logger.info(f"Processing {file}...")
+        metrics = LayerMetrics(file.stem)
+        with metrics.time("load"):
+            source = pd.read_parquet(file).dropna(subset=["easting", "northing"])
+        distances = network.route(
+            source,
+            postcodes[TARGET_COLUMNS],
+            facilities=_facilities(source, file.stem),
+            metrics=metrics,
+        )
+        with metrics.time("write"):
+            write_distances(distances, file.stem)
+        metrics.record_rss()
+        report.append(metrics)
+        logger.info(f"Done processing {file}...")
+    write_report(report, Paths.METRICS / "routing", prometheus)
+
+
+def list_tiles(scheme: str = "grid") -> list[str]:
+    return sorted(assign_tiles(_load_postcodes(), scheme).dropna().unique())
+
+
+def _unreached_inexact(
+    network: Network,
+    points: pd.DataFrame,
+    profile: str,
+    bounds: tuple[float, float, float, float],
+    layer: str,
+) -> np.ndarray:
+    # an unreachable postcode is only final when its whole road component is
+    # inside the clip and none of the layer's POIs snap onto that component
+    extents, poi_components = _load_components()
+    labels = network.components[profile][network.snap(points)]
+    extent = extents.loc[profile].reindex(labels)
+    xmin, ymin, xmax, ymax = bounds
+    inside = (
+        (extent["xmin"] >= xmin)
+        & (extent["ymin"] >= ymin)
+        & (extent["xmax"] <= xmax)
+        & (extent["ymax"] <= ymax)
+    ).to_numpy()
+    return ~inside | np.isin(labels, poi_components.get((layer, profile), []))
+
+
+def _inexact(
+    network: Network,
+    distances: pd.DataFrame,
+    bounds: tuple[float, float, float, float],
+    layer: str,
+    buffer_minutes: float,
+) -> np.ndarray:
+    inexact = np.zeros(len(distances), dtype=bool)
+    for profile in network.profiles:
+        column = distances[distance_column(profile)]
+        inexact |= (column > exact_minutes(profile, buffer_minutes)).to_numpy()
+        unreached = column.isna().to_numpy()
+        if unreached.any():
+            inexact[unreached] |= _unreached_inexact(
+                network, distances[unreached], profile, bounds, layer
+            )
+    return inexact
+
+
+def _clip(
+    networks: dict,
+    tile_target: pd.DataFrame,
+    buffer_minutes: float,
+    profiles: list[str] | None,
+    metrics: LayerMetrics,
+):
+    # clips only depend on the tile and the buffer, so one escalated to for an
+    # earlier layer is reused by the later ones instead of being read again
+    if buffer_minutes not in networks:
+        with metrics.time("load"):
+            bounds = tile_bounds(tile_target, buffer_minutes)
+            nodes, edges, complete = read_clip(bounds)
+            networks[buffer_minutes] = bounds, Network(nodes, edges, profiles), complete
+    return networks[buffer_minutes]
+
+
+def _route_buffered(
+    networks: dict,
+    source: pd.DataFrame,
+    tile_target: pd.DataFrame,
+    layer: str,
+    buffer_minutes: float,
+    profiles: list[str] | None,
+    metrics: LayerMetrics,
+) -> pd.DataFrame:
+    # postcodes that may not be exact are re-routed with double the buffer until
+    # they are, or until the clip holds the whole network and the result is final
+    target, routed = tile_target, []
+    while True:
+        bounds, network, complete = _clip(
+            networks, tile_target, buffer_minutes, profiles, metrics
+        )
+        nearby = source[within(source, bounds)]
+        distances = network.route(
+            nearby, target, facilities=_facilities(nearby, layer), metrics=metrics
+        )
+        inexact = _inexact(network, distances, bounds, layer, buffer_minutes)
+        if complete or not inexact.any():
+            routed.append(distances)
+            return pd.concat(routed, ignore_index=True)
+
+        routed.append(distances[~inexact])
+        target = target[inexact]
+        buffer_minutes *= 2
+        logger.info(
+            f"Re-routing {len(target)} postcodes with a "
+            f"{buffer_minutes} minute buffer..."
+        )
+
+
+def route_tile(
+    tile: str,
+    scheme: str = "grid",
+    buffer_minutes: float = Config.TILE_BUFFER_MINUTES,
+    profiles: list[str] | None = None,
+    prometheus: Path | None = None,
+):
+    report = [LayerMetrics("network", tile)]
+    with report[0].time("load"):
+        postcodes = _load_postcodes()
+        target = postcodes.loc[
+            assign_tiles(postcodes, scheme) == tile, TARGET_COLUMNS
+        ]
+    networks = {}
+    _clip(networks, target, buffer_minutes, profiles, report[0])
+    report[0].record_rss()
+
+    for file in _layers():
+        outfile = Paths.TILES / file.stem / f"{tile}.parquet"
+        if outfile.exists():
+            logger.info(f"Skipping {tile} {file.stem} as {outfile} already exists.")
+            continue
+        logger.info(f"Processing {tile} {file.stem}...")
+        metrics = LayerMetrics(file.stem, tile)
+        with metrics.time("load"):
+            source = pd.read_parquet(file).dropna(subset=["easting", "northing"])
+        distances = _route_buffered(
+            networks, source, target, file.stem, buffer_minutes, profiles, metrics
+        )
+        metrics.sources, metrics.targets = len(source), len(target)
+        with metrics.time("write"):
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            distances.to_parquet(outfile)
+        metrics.record_rss()
+        report.append(metrics)
+
+    # node_exporter reads every *.prom file in its directory, so each tile
+    # gets its own textfile rather than overwriting the others
+    if prometheus is not None:
+        prometheus = prometheus.with_name(f"{prometheus.stem}_{tile}.prom")
+    write_report(report, Paths.METRICS / f"routing_{tile}", prometheus)
+    return tile
+
+
+def route_tiles_local(
+    workers: int | None = None,
+    scheme: str = "grid",
+    buffer_minutes: float = Config.TILE_BUFFER_MINUTES,
+    profiles: list[str] | None = None,
+    prometheus: Path | None = None,
+):
+    tiles = list_tiles(scheme)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(route_tile, tile, scheme, buffer_minutes, profiles, prometheus)
+            for tile in tiles
+        ]
+        for future in tqdm(futures):
+            logger.info(f"Done processing tile {future.result()}...")
+
+
+def merge_tiles(scheme: str = "grid"):
+    tiles = list_tiles(scheme)
+    for file in _layers():
+        tile_files = [Paths.TILES / file.stem / f"{tile}.parquet" for tile in tiles]
+        missing = [f.stem for f in tile_files if not f.exists()]
+        if missing:
+            logger.warning(f"Skipping {file.stem}, missing tiles: {missing}")
+            continue
+        distances = pd.concat(
+            [pd.read_parquet(f) for f in tile_files], ignore_index=True
+        )
+        write_distances(distances, file.stem)
+        logger.info(f"Merged {len(tile_files)} tiles for {file.stem}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Route postcodes to each POI layer.")
+    parser.add_argument("--scheme", choices=["grid", "nation"], default="grid")
+    parser.add_argument("--buffer", type=float, default=Config.TILE_BUFFER_MINUTES)
+    parser.add_argument(
+        "--profiles", nargs="+", choices=list(Config.PROFILES), default=None
+    )
+    parser.add_argument(
+        "--prometheus", type=Path, default=None, help="also write a .prom textfile"
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("tiles", help="list tile names, one per line")
+    tile = commands.add_parser("tile", help="route a single tile")
+    tile.add_argument("tile")
+    local = commands.add_parser("local", help="route all tiles on a process pool")
+    local.add_argument("--workers", type=int, default=None)
+    commands.add_parser("merge", help="merge tile outputs into *_distances.parquet")
+    args = parser.parse_args()
+
+    if args.command == "tiles":
+        print("\n".join(list_tiles(args.scheme)))
+    elif args.command == "tile":
+        route_tile(args.tile, args.scheme, args.buffer, args.profiles, args.prometheus)
+    elif args.command == "local":
+        route_tiles_local(
+            args.workers, args.scheme, args.buffer, args.profiles, args.prometheus
+        )
+        merge_tiles(args.scheme)
+    elif args.command == "merge":
+        merge_tiles(args.scheme)
+    else:
+        route_all(args.profiles, args.prometheus)
+
+
+if __name__ == "__main__":
+    main()